@@ -5,13 +5,131 @@ Provides helper functions for constructing and running 'findscu'
 commands in a Docker container and parsing the results.
 """
 
-import subprocess
 import re
+import sys
+import atexit
+import shutil
+import functools
+import itertools
+import tempfile
+import subprocess
+
+# Use a locally installed dcm4che findscu instead of Docker when it is on PATH
+_USE_LOCAL = shutil.which("findscu") is not None
+
+# Fixed parts of every findscu command, shared instead of rebuilt per query
+_FINDSCU_PATH = "/opt/dcm4che/bin/findscu"
+_FIND_RUN_PREFIX = ("docker", "run", "--rm", "--entrypoint", _FINDSCU_PATH)
+_FIND_SUFFIX = ("-L", "STUDY")
+
+# Spawn options that keep subprocess on its posix_spawn() (vfork + exec) fast path
+# (also used by download_dicom).
+# Inherited descriptors are safe to keep open: Python creates them non-inheritable.
+_SPAWN_KWARGS = {"close_fds": False, "start_new_session": False}
+
+# Persistent containers (findscu and cfmm2tar) not yet stopped; _stop_leftover_containers
+# removes any still running on exit (e.g. after an interrupt)
+_live_containers = set()
+
+_HEX_DIGITS = frozenset("0123456789abcdefABCDEF")
+
+# C-FIND-RSP status codes that close a dataset item (pending / success).
+# They sit at the end of the response line, so only its tail is searched.
+_STATUS_RE = re.compile(r"status=(?:ff00H|0H)\b")
+_STATUS_TAIL = 20
+
+
+@functools.lru_cache(maxsize=None)
+def _resolve_executable(name):
+    """Resolves a command name to its full path once.
+
+    subprocess only takes the posix_spawn() fast path when the executable is
+    given with a directory, so commands are launched with the resolved path.
+
+    Args:
+        name (str): The command name, e.g. "docker".
+
+    Returns:
+        str: The full path if found on PATH, otherwise `name` unchanged.
+    """
+    return shutil.which(name) or name
+
+
+def start_idle_container(image, volumes=()):
+    """Starts a detached, idle container that commands can be `docker exec`'d into.
+
+    The container runs `sleep infinity` until it is removed with `stop_container`; one
+    still running at exit is removed then.
+
+    Args:
+        image (str): Name of the Docker container image (e.g. 'cfmm2tar').
+        volumes (iterable of str, optional): `docker run -v` specifications to mount.
+
+    Returns:
+        str or None: The container ID, or None if the container could not be started.
+    """
+    mounts = [arg for volume in volumes for arg in ("-v", volume)]
+    result = subprocess.run(
+        ["docker", "run", "-d", "--rm", *mounts, "--entrypoint", "sleep", image, "infinity"],
+        executable=_resolve_executable("docker"), capture_output=True, text=True,
+        **_SPAWN_KWARGS
+    )
+    if result.returncode != 0:
+        return None
+    container_id = result.stdout.strip()
+    _live_containers.add(container_id)
+    return container_id
+
+
+def stop_container(container_id):
+    """Removes a container started by `start_idle_container`.
+
+    Args:
+        container_id (str): The container ID.
+
+    Returns:
+        None
+    """
+    _live_containers.discard(container_id)
+    subprocess.run(["docker", "rm", "-f", container_id], executable=_resolve_executable("docker"),
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, **_SPAWN_KWARGS)
+
+
+@atexit.register
+def _stop_leftover_containers():
+    """Removes the containers that were never stopped explicitly, on exit.
+
+    Returns:
+        None
+    """
+    for container_id in list(_live_containers):
+        stop_container(container_id)
 
 
-def build_base_findscu_cmd(container, bind, server, port, tls, username, password, query_tags):
+def start_findscu_container(container):
+    """Starts a detached, idle container that findscu queries can be exec'd into.
+
+    Reusing one container avoids paying the `docker run` startup cost for every
+    query. Callers remove it with `stop_container`.
+
+    Args:
+        container (str): Name of the Docker container image (e.g. 'cfmm2tar').
+
+    Returns:
+        str or None: The container ID, or None if the container could not be started
+        (or is not needed because findscu is installed locally).
+    """
+    if _USE_LOCAL:
+        return None
+    return start_idle_container(container)
+
+
+def build_base_findscu_cmd(container, bind, server, port, tls, username, password, query_tags,
+                           container_id=None):
     """Constructs the base Docker command for dcm4che's findscu with specified query tags.
 
+    If findscu is installed locally it is called directly, without Docker.
+
     Args:
         container (str): Name of the Docker container image (e.g. 'cfmm2tar').
         bind (str): Networking bind option for the container (e.g. 'DEFAULT').
@@ -21,25 +139,54 @@ def build_base_findscu_cmd(container, bind, server, port, tls, username, passwor
         username (str): Username for the DICOM server.
         password (str): Password for the DICOM server.
         query_tags (list): A list of DICOM attributes (e.g. ["PatientName"]).
+        container_id (str, optional): A running container from `start_findscu_container`.
+            If given, findscu is run with `docker exec` instead of a new `docker run`.
 
     Returns:
         list: A list of command elements that can be passed to subprocess.
     """
-    cmd = [
-        "docker", "run",
-        "--rm",
-        "--entrypoint", "/opt/dcm4che/bin/findscu",
-        container,
+    if _USE_LOCAL:
+        prefix = ("findscu",)
+    elif container_id:
+        prefix = ("docker", "exec", container_id, _FINDSCU_PATH)
+    else:
+        prefix = (*_FIND_RUN_PREFIX, container)
+    return [
+        *prefix,
         "--bind", bind,
         "--connect", f"{server}:{port}",
         f"--tls-{tls}",
         "--user", username,
         "--user-pass", password,
-        "-L", "STUDY"
+        *_FIND_SUFFIX,
+        *itertools.chain.from_iterable(("-r", tag_name) for tag_name in query_tags)
     ]
 
-    for tag_name in query_tags:
-        cmd += ["-r", tag_name]
+
+def build_findscu(container, bind, server, port, tls, username, password, query_tags,
+                  match_key=None, match_value=None, container_id=None):
+    """Creates a findscu command list, optionally matching one attribute.
+
+    Args:
+        container (str): Name of the Docker container image.
+        bind (str): Networking bind option for the container.
+        server (str): DICOM server string (e.g. 'CFMM@dicom.cfmm.uwo.ca').
+        port (str): DICOM server port.
+        tls (str): TLS setting for encryption.
+        username (str): Username for the DICOM server.
+        password (str): Password for the DICOM server.
+        query_tags (list): A list of DICOM attributes to retrieve.
+        match_key (str, optional): Attribute to match (e.g. 'StudyDescription').
+        match_value (str, optional): Value to match. If empty, all studies are returned.
+        container_id (str, optional): A running container to `docker exec` into.
+
+    Returns:
+        list: Command list for subprocess to execute.
+    """
+    cmd = build_base_findscu_cmd(container, bind, server, port, tls, username, password, query_tags,
+                                 container_id=container_id)
+    if match_key and match_value:
+        cmd += ["-m", f"{match_key}={match_value}"]
     return cmd
 
 
@@ -61,10 +208,8 @@ def build_findscu_for_description(container, bind, server, port, tls, username,
     Returns:
         list: Command list for subprocess to execute.
     """
-    cmd = build_base_findscu_cmd(container, bind, server, port, tls, username, password, query_tags)
-    if study_description:
-        cmd += ["-m", f"StudyDescription={study_description}"]
-    return cmd
+    return build_findscu(container, bind, server, port, tls, username, password, query_tags,
+                         "StudyDescription", study_description)
 
 
 def build_findscu_for_patient_name(container, bind, server, port, tls, username, password,
@@ -85,10 +230,8 @@ def build_findscu_for_patient_name(container, bind, server, port, tls, username,
     Returns:
         list: Command list for subprocess to execute.
     """
-    cmd = build_base_findscu_cmd(container, bind, server, port, tls, username, password, query_tags)
-    if patient_name:
-        cmd += ["-m", f"PatientName={patient_name}"]
-    return cmd
+    return build_findscu(container, bind, server, port, tls, username, password, query_tags,
+                         "PatientName", patient_name)
 
 
 def build_findscu_for_all_studies(container, bind, server, port, tls, username, password,
@@ -108,37 +251,200 @@ def build_findscu_for_all_studies(container, bind, server, port, tls, username,
     Returns:
         list: Command list for subprocess to execute.
     """
-    cmd = build_base_findscu_cmd(container, bind, server, port, tls, username, password, query_tags)
-    return cmd
+    return build_findscu(container, bind, server, port, tls, username, password, query_tags)
 
 
-def run_findscu(cmd, debug=False):
-    """Runs the findscu command via subprocess and captures its output.
+def run_findscu(cmd, debug=False, verbose=False):
+    """Runs the findscu command via subprocess and collects its output line by line.
+
+    Stdout is read incrementally from a pipe rather than captured as one string
+    and split afterwards, so the output is only held in memory once.
 
     Args:
         cmd (list): List of command elements for the findscu utility.
         debug (bool, optional): If True, prints debug statements.
+        verbose (bool, optional): If True (together with `debug`), also dumps every
+            output line.
 
     Returns:
-        str or None: The standard output from the command, or None if an error occurred.
+        list of str or None: The output lines (with line endings), or None if an error
+        occurred.
     """
     if debug:
         print("[DEBUG] Running command:", " ".join(cmd))
 
-    result = subprocess.run(cmd, capture_output=True, text=True)
-    if result.returncode != 0:
-        if debug:
-            print("[DEBUG] findscu encountered an error:\n", result.stderr)
-        return None
+    # Stderr goes to a temporary file so a chatty stderr can never block the stdout pipe
+    with tempfile.TemporaryFile(mode="w+") as err_file:
+        with subprocess.Popen(cmd, executable=_resolve_executable(cmd[0]),
+                              stdout=subprocess.PIPE, stderr=err_file,
+                              text=True, bufsize=1, **_SPAWN_KWARGS) as proc:
+            lines = list(proc.stdout)
+            returncode = proc.wait()
+
+        if returncode != 0:
+            if debug:
+                err_file.seek(0)
+                print("[DEBUG] findscu encountered an error:\n", err_file.read())
+            return None
+
+    if debug and verbose:
+        # One write for the whole dump instead of one print (and flush) per line
+        sys.stdout.write("".join(f"[DEBUG] LINE {i}: {line!r}\n"
+                                 for i, line in enumerate(lines)))
+    return lines
+
+
+def stream_findscu(cmd, debug=False, verbose=False):
+    """Runs the findscu command and yields its stdout lines while it is still running.
+
+    Pairs with `iter_studies`, so parsing overlaps the query and only one study is in
+    memory at a time.
+
+    Args:
+        cmd (list): List of command elements for the findscu utility.
+        debug (bool, optional): If True, prints debug statements.
+        verbose (bool, optional): If True (together with `debug`), also dumps every
+            output line once the output is exhausted.
 
+    Yields:
+        str: Each output line (with its line ending). If findscu exits with an error a
+        warning is printed once the output is exhausted.
+    """
     if debug:
-        lines = result.stdout.splitlines()
-        for i, line in enumerate(lines):
-            print(f"[DEBUG] LINE {i}: {repr(line)}")
-    return result.stdout
+        print("[DEBUG] Running command:", " ".join(cmd))
+    dump = debug and verbose
+    dump_lines = []
+
+    with tempfile.TemporaryFile(mode="w+") as err_file:
+        with subprocess.Popen(cmd, executable=_resolve_executable(cmd[0]),
+                              stdout=subprocess.PIPE, stderr=err_file, text=True, bufsize=1,
+                              **_SPAWN_KWARGS) as proc:
+            for line in proc.stdout:
+                if dump:
+                    dump_lines.append(f"[DEBUG] LINE {len(dump_lines)}: {line!r}\n")
+                yield line
+            returncode = proc.wait()
+
+        if dump:
+            # One write for the whole dump, as in run_findscu
+            sys.stdout.write("".join(dump_lines))
+
+        if returncode != 0:
+            print(f"[WARNING] findscu exited with status {returncode}.")
+            if debug:
+                err_file.seek(0)
+                print("[DEBUG] findscu encountered an error:\n", err_file.read())
+
+
+def batch_findscu(container, bind, server, port, tls, username, password, query_tags,
+                  match_key, match_values, debug=False, verbose=False):
+    """Runs one findscu query per match value inside a single container.
+
+    findscu accepts only one value per matching key, so the queries are still issued
+    one by one, but they are all `docker exec`'d into one persistent container instead
+    of paying a `docker run` startup per query.
+
+    Args:
+        container (str): Name of the Docker container image.
+        bind (str): Networking bind option for the container.
+        server (str): DICOM server string (e.g. 'CFMM@dicom.cfmm.uwo.ca').
+        port (str): DICOM server port.
+        tls (str): TLS setting for encryption.
+        username (str): Username for the DICOM server.
+        password (str): Password for the DICOM server.
+        query_tags (list): A list of DICOM attributes to retrieve.
+        match_key (str): Attribute to match (e.g. 'PatientName').
+        match_values (iterable of str): One value (wildcards allowed) per query.
+        debug (bool, optional): If True, prints debug statements.
+        verbose (bool, optional): If True (together with `debug`), also dumps every
+            output line (see `stream_findscu`).
+
+    Yields:
+        str: The output lines of all queries, streamed as in `stream_findscu`.
+    """
+    container_id = start_findscu_container(container)
+    if not container_id and not _USE_LOCAL and debug:
+        print("[DEBUG] Could not start a persistent container; using one docker run per query.")
+
+    try:
+        for value in match_values:
+            cmd = build_findscu(container, bind, server, port, tls, username, password, query_tags,
+                                match_key, value, container_id=container_id)
+            yield from stream_findscu(cmd, debug=debug, verbose=verbose)
+    finally:
+        if container_id:
+            stop_container(container_id)
+
+
+def _tag_key(group_elem, vr):
+    """Packs a tag and its VR into a single integer dictionary key.
+
+    The 8 hex digits of '(GGGG,EEEE)' form the upper 32 bits and the two
+    VR characters the lower 16 bits, e.g. ("(0010,0010)", "PN") -> 0x00100010504E.
+
+    Args:
+        group_elem (str): The tag as written by findscu, e.g. "(0010,0010)".
+        vr (str): The two-letter value representation, e.g. "PN".
+
+    Returns:
+        int: The packed key.
+    """
+    return (int(group_elem[1:5] + group_elem[6:10], 16) << 16) | (ord(vr[0]) << 8) | ord(vr[1])
+
+
+def _record_layout(tag_map):
+    """Precomputes the flat record layout shared by the findscu parsers.
+
+    Args:
+        tag_map (dict): Maps attribute names to their 'group_elem', 'vr' and 'field'.
+
+    Returns:
+        tuple:
+            - list: Field names, in slot order.
+            - dict: Packed `_tag_key` -> slot index.
+            - int or None: Slot of 'study_uid', if mapped.
+            - list: A record of all-None slots, copied to reset a record in one step.
+    """
+    field_names = [info["field"] for info in tag_map.values()]
+    reverse_map = {}
+    for idx, info in enumerate(tag_map.values()):
+        reverse_map[_tag_key(info["group_elem"], info["vr"])] = idx
+    uid_idx = field_names.index("study_uid") if "study_uid" in field_names else None
+    return field_names, reverse_map, uid_idx, [None] * len(field_names)
+
+
+def _parse_line(line):
+    """Splits a findscu attribute line into its packed tag key and value.
+
+    Scans lines of the fixed form:
+        (0010,0010) PN [Doe^John] PatientName
+    by direct indexing, which is much cheaper than running a regex per line.
 
+    Args:
+        line (str): A single line of findscu output.
+
+    Returns:
+        tuple or None: (key, value), where key is built by `_tag_key`,
+        or None if the line is not an attribute line.
+    """
+    if len(line) < 15 or line[0] != "(" or line[5] != "," or line[10] != ")":
+        return None
+    if not (_HEX_DIGITS.issuperset(line[1:5]) and _HEX_DIGITS.issuperset(line[6:10])):
+        return None
+    if not line[11].isspace():
+        return None
+
+    parts = line[12:].split(None, 1)
+    if len(parts) != 2:
+        return None
+    vr, rest = parts
+    end = rest.rfind("]")
+    if len(vr) != 2 or rest[0] != "[" or end < 1:
+        return None
+    return _tag_key(line, vr), rest[1:end]
 
-def parse_studies_with_demographics(output, tag_map):
+
+def parse_studies_with_demographics(lines, tag_map):
     """Parses 'findscu' text output and maps recognized DICOM tags to a list of study dictionaries.
 
     This function looks for lines like:
@@ -146,7 +452,8 @@ def parse_studies_with_demographics(output, tag_map):
     and uses `tag_map` to know that (0008,1030), LO -> 'study_description'.
 
     Args:
-        output (str): Text output from the findscu command.
+        lines (iterable of str): Output lines from the findscu command (e.g. as returned
+            by `run_findscu`). A single string is also accepted and split into lines.
         tag_map (dict): Maps attribute strings (e.g. 'PatientName') to a dict of:
             {
               "group_elem": "(0010,0010)",
@@ -157,44 +464,100 @@ def parse_studies_with_demographics(output, tag_map):
     Returns:
         list of dict: Each dict contains keys such as 'patient_name', 'study_date', 'study_uid', etc.
     """
-    reverse_map = {}
-    for attr_name, info in tag_map.items():
-        ge = info["group_elem"]
-        vr = info["vr"]
-        field_name = info["field"]
-        reverse_map[(ge, vr)] = field_name
+    if isinstance(lines, str):
+        lines = lines.splitlines()
+    return list(iter_studies(lines, tag_map))
 
-    # Initialize 'current' with None for each field
-    current = {}
-    for _, info in tag_map.items():
-        current[info["field"]] = None
 
-    studies = []
-    lines = output.splitlines()
+def _iter_records(lines, reverse_map, uid_idx, none_template):
+    """Yields each study in findscu text output as a tuple of field values.
 
-    for line in lines:
-        match = re.search(r'^\(([\dA-Fa-f]{4},[\dA-Fa-f]{4})\)\s+(\S+)\s+\[(.*)\]', line)
-        if match:
-            group_elem_raw = match.group(1)
-            vr = match.group(2)
-            value = match.group(3)
-            group_elem = f"({group_elem_raw})"
+    Args:
+        lines (iterable of str): Output lines from the findscu command.
+        reverse_map (dict): Maps a `_tag_key` to a field index (see `_record_layout`).
+        uid_idx (int or None): Index of the 'study_uid' field.
+        none_template (list): A record with every field set to None.
 
-            if (group_elem, vr) in reverse_map:
-                field_name = reverse_map[(group_elem, vr)]
-                current[field_name] = value
+    Yields:
+        tuple: The field values of one study, in `_record_layout` field order.
+    """
+    current = list(none_template)
+    lookup = reverse_map.get
+    status_search = _STATUS_RE.search
+
+    for line in lines:
+        # A line is either an attribute line or (possibly) a status line, never both
+        if line[:1] == "(":
+            parsed = _parse_line(line)
+            if parsed:
+                idx = lookup(parsed[0])
+                if idx is not None:
+                    current[idx] = parsed[1]
+                continue
 
         # status=ff00H or status=0H indicates end of a dataset item
-        if "status=ff00H" in line or "status=0H" in line:
-            if current.get("study_uid"):
-                studies.append(dict(current))
+        if status_search(line, max(0, len(line) - _STATUS_TAIL)):
+            if uid_idx is not None and current[uid_idx]:
+                yield tuple(current)
             # Reset for the next dataset
-            current = {}
-            for _, info in tag_map.items():
-                current[info["field"]] = None
+            current[:] = none_template
+
+    # If any leftover record is populated
+    if uid_idx is not None and current[uid_idx]:
+        yield tuple(current)
+
 
-    # If any leftover dictionary is populated
-    if current.get("study_uid"):
-        studies.append(dict(current))
+def iter_studies(lines, tag_map):
+    """Parses findscu text output lazily, yielding each study as soon as it is complete.
 
-    return studies
+    Unlike `parse_studies_with_demographics`, only the study being assembled is held
+    in memory, so it can consume `stream_findscu` while findscu is still running.
+
+    Args:
+        lines (iterable of str): Output lines from the findscu command.
+        tag_map (dict): Maps attribute strings to their group/element, VR and field name
+            (see `parse_studies_with_demographics`).
+
+    Yields:
+        dict: One study with keys such as 'patient_name', 'study_date', 'study_uid', etc.
+    """
+    field_names, reverse_map, uid_idx, none_template = _record_layout(tag_map)
+    for record in _iter_records(lines, reverse_map, uid_idx, none_template):
+        yield dict(zip(field_names, record))
+
+
+def parse_studies_columnar(lines, tag_map):
+    """Parses findscu text output into one list per field instead of one dict per study.
+
+    For large result sets this keeps each field contiguous, so sorting, grouping and
+    printing work on a few flat lists. Use `get_study` where a study dict is needed.
+
+    Args:
+        lines (iterable of str): Output lines from the findscu command.
+        tag_map (dict): Maps attribute strings to their group/element, VR and field name
+            (see `parse_studies_with_demographics`).
+
+    Returns:
+        dict: Maps each field name (e.g. 'study_date') to a list with one value per
+        study; all lists have the same length.
+    """
+    field_names, reverse_map, uid_idx, none_template = _record_layout(tag_map)
+    column_lists = [[] for _ in field_names]
+    # Each record is appended straight into the columns, so only one layout is held
+    for record in _iter_records(lines, reverse_map, uid_idx, none_template):
+        for values, value in zip(column_lists, record):
+            values.append(value)
+    return dict(zip(field_names, column_lists))
+
+
+def get_study(columns, index):
+    """Builds the study dictionary for one entry of `parse_studies_columnar` output.
+
+    Args:
+        columns (dict): Field name -> list of values.
+        index (int): Position of the study in the lists.
+
+    Returns:
+        dict: The study, with the same keys as `iter_studies` yields.
+    """
+    return {name: values[index] for name, values in columns.items()}
@@ -10,8 +10,17 @@ cleanup and basic metadata storage.
 import os
 import re
 import json
+import atexit
+import asyncio
+import bisect
+import shutil
+import functools
+import threading
+import tempfile
 import subprocess
 
+from dicom_query import _SPAWN_KWARGS, _resolve_executable, start_idle_container
+
 # Directory of JSON file containing metadata of subjects
 METADATA_FILE = os.path.join(
     os.path.dirname(__file__),  # current file directory
@@ -22,32 +31,257 @@ METADATA_FILE = os.path.join(
     "dicom_metadata.json"       # metadata filename
 )
 
-# In-memory store for subject metadata
+# Append-only log of entries not yet flushed to METADATA_FILE (for crash recovery)
+METADATA_JOURNAL = os.path.splitext(METADATA_FILE)[0] + ".journal.jsonl"
+
+# Call a locally installed cfmm2tar instead of the Docker image when it is on PATH
+_USE_LOCAL = shutil.which("cfmm2tar") is not None
+
+# Shell loop run inside one cfmm2tar container by download_dicom_batch: each line of
+# /batch/uids.txt is "<uid> <dir relative to /data>"; the UIDs that succeeded are
+# recorded in /batch/done. cfmm2tar reads /dev/null so it cannot consume the UID list.
+_BATCH_SCRIPT = (
+    'while read -r uid subdir; do '
+    'mkdir -p "/data/$subdir" && '
+    'cfmm2tar -c /mysecrets/uwo_credentials -u "$uid" "/data/$subdir" </dev/null && '
+    'echo "$uid" >> /batch/done; '
+    'done < /batch/uids.txt'
+)
+
+# Precompiled patterns for the age and subject-number lookups
+_AGE_RE = re.compile(r"(\d+)")
+_SUBNUM_RE = re.compile(r"\d+")
+
+# In-memory store for subject metadata (guarded by _metadata_lock for parallel downloads).
+# The file is read once on first use and written once by flush_metadata(); in between,
+# each new entry is only appended to METADATA_JOURNAL.
 _collected_metadata = {}
+_sorted_keys = []  # (subject_number(label), label), kept sorted on insertion
+_metadata_loaded = False
+_metadata_dirty = False
+_metadata_lock = threading.Lock()
 
-def download_dicom(study, credentials_file, do_cleanup=False, create_dicom_metadata=False):
-    """Executes the Docker command to download the specified study into its output directory.
+# Serializes status output, since downloads report from several threads at once
+_print_lock = threading.Lock()
 
-    Optionally removes leftover *.attached.tar or *.uid files if `do_cleanup=True`.
-    If `create_dicom_metadata=True`, collects demographic data (age/sex) and writes
-    it to sourcedata/dicom/dicom_metadata.json.
+
+@functools.lru_cache(maxsize=None)
+def subject_number(label):
+    """Extracts the integer portion from a subject label for sorting purposes.
+
+    For example, "sub-010" becomes 10, "sub-2" becomes 2, and if no digits are found,
+    a fallback value of 999999999 is returned to ensure such labels sort last.
+    Results are memoized, since the same labels are ranked on every flush.
 
     Args:
-        study (dict): A dictionary containing study metadata, such as 'study_uid' and 'out_dir'.
-            Also may include 'sub_label', 'patient_sex', etc.
-        credentials_file (str): The path to the credentials file to mount into Docker.
-        do_cleanup (bool, optional): Whether to remove leftover temporary files after download.
-        create_dicom_metadata (bool, optional): If True, store demographic info in JSON logs.
+        label (str): The subject label, e.g. "sub-010" or "sub-002_baseline".
+
+    Returns:
+        int: The numeric portion of the subject label if digits are found, otherwise 999999999.
+    """
+    m = _SUBNUM_RE.search(label)
+    return int(m.group()) if m else 999999999
+
+
+def _log(*lines):
+    """Prints a status block as one write, so blocks of parallel downloads never interleave.
+
+    Args:
+        *lines (str): The lines of the block.
 
     Returns:
         None
     """
-    study_uid = study["study_uid"]
-    out_dir = study["out_dir"]
-    sub_label = study.get("sub_label", "sub-unknown")
+    with _print_lock:
+        print("\n".join(lines), flush=True)
+
+
+def _study_header(study):
+    """Returns the 'Subject | Session' header lines printed before a study's download.
+
+    Args:
+        study (dict): The study ('sub_label', 'ses_label').
+
+    Returns:
+        tuple of str: The header lines.
+    """
+    return (f"Subject:    {study.get('sub_label', 'sub-unknown')}   | "
+            f"Session: {study.get('ses_label')}",
+            "--------------------------------------------------")
+
+
+def _insert_metadata(sub_label, entry):
+    """Adds or replaces a subject entry, keeping `_sorted_keys` in subject order.
+
+    Must be called with `_metadata_lock` held.
+
+    Args:
+        sub_label (str): The subject label, e.g. "sub-001".
+        entry (dict): The metadata to store.
+
+    Returns:
+        None
+    """
+    if sub_label not in _collected_metadata:
+        bisect.insort(_sorted_keys, (subject_number(sub_label), sub_label))
+    _collected_metadata[sub_label] = entry
+
+
+def _load_metadata():
+    """Merges the existing metadata file into the in-memory store on first use.
+
+    Must be called with `_metadata_lock` held.
+
+    Returns:
+        None
+    """
+    global _metadata_loaded, _metadata_dirty
+    if _metadata_loaded:
+        return
+    _metadata_loaded = True
+
+    if os.path.isfile(METADATA_FILE):
+        try:
+            with open(METADATA_FILE, "r") as f:
+                existing_data = json.load(f)
+                for k, v in existing_data.items():
+                    if k not in _collected_metadata:
+                        _insert_metadata(k, v)
+        except (json.JSONDecodeError, OSError) as e:
+            print(f"[WARNING] Could not read/parse {METADATA_FILE}: {e}")
+
+    # Replay entries left in the journal by a run that exited before flushing
+    if os.path.isfile(METADATA_JOURNAL):
+        try:
+            with open(METADATA_JOURNAL, "r") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    for k, v in json.loads(line).items():
+                        _insert_metadata(k, v)
+                        _metadata_dirty = True
+        except (json.JSONDecodeError, OSError) as e:
+            print(f"[WARNING] Could not read/parse {METADATA_JOURNAL}: {e}")
 
-    # Build the Docker command as a list for subprocess
-    docker_cmd = [
+
+def _store_metadata(sub_label, entry):
+    """Records one subject's metadata in the in-memory store.
+
+    Args:
+        sub_label (str): The subject label, e.g. "sub-001".
+        entry (dict): The metadata to store, e.g. {"age": 34, "sex": "F"}.
+
+    Returns:
+        None
+    """
+    global _metadata_dirty
+    with _metadata_lock:
+        _load_metadata()
+        _insert_metadata(sub_label, entry)
+        _metadata_dirty = True
+
+        # Append just this entry to the journal; the full file is written on flush
+        try:
+            os.makedirs(os.path.dirname(METADATA_JOURNAL), exist_ok=True)
+            with open(METADATA_JOURNAL, "a") as f:
+                f.write(json.dumps({sub_label: entry}) + "\n")
+        except OSError as e:
+            print(f"[WARNING] Could not write to {METADATA_JOURNAL}: {e}")
+
+
+@atexit.register
+def flush_metadata():
+    """Writes the collected metadata to METADATA_FILE, sorted by subject number.
+
+    The file is written to a temporary path and moved into place so an interrupted
+    write cannot corrupt it, after which the journal is cleared. Does nothing if no
+    metadata was collected since the last flush. Registered to run automatically on
+    exit; call it directly when intermediate persistence is needed.
+
+    Returns:
+        None
+    """
+    global _metadata_dirty
+    with _metadata_lock:
+        if not _metadata_dirty:
+            return
+
+        # Ensure directory is created before writing
+        metadata_dir = os.path.dirname(METADATA_FILE)
+        os.makedirs(metadata_dir, exist_ok=True)
+
+        # Subjects are already kept in ascending numeric order
+        ordered_data = {k: _collected_metadata[k] for _, k in _sorted_keys}
+
+        # Write updated metadata in sorted order, atomically
+        tmp_file = METADATA_FILE + ".tmp"
+        try:
+            with open(tmp_file, "w") as f:
+                json.dump(ordered_data, f, indent=2)
+            os.replace(tmp_file, METADATA_FILE)
+            _metadata_dirty = False
+        except OSError as e:
+            print(f"[WARNING] Could not write to {METADATA_FILE}: {e}")
+            return
+
+        # Everything in the journal is now in METADATA_FILE
+        try:
+            os.remove(METADATA_JOURNAL)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"[WARNING] Could not remove {METADATA_JOURNAL}: {e}")
+
+
+def start_download_container(credentials_file, data_root):
+    """Starts a detached, idle cfmm2tar container that downloads can be exec'd into.
+
+    The credentials file and data_root are mounted once, so each download is a
+    `docker exec` instead of a full `docker run`. Callers remove it with
+    `dicom_query.stop_container`.
+
+    Args:
+        credentials_file (str): The path to the credentials file to mount.
+        data_root (str): A directory containing every output directory to be used.
+
+    Returns:
+        str or None: The container ID, or None if the container could not be started
+        (or is not needed because cfmm2tar is installed locally).
+    """
+    if _USE_LOCAL:
+        return None
+    return start_idle_container("cfmm2tar", volumes=(
+        f"{credentials_file}:/mysecrets/uwo_credentials:ro",
+        f"{data_root}:/data",
+    ))
+
+
+def _build_download_cmd(study_uid, out_dir, credentials_file, container_id=None, data_root=None):
+    """Builds the cfmm2tar command that downloads one study into out_dir.
+
+    Args:
+        study_uid (str): The StudyInstanceUID to download.
+        out_dir (str): The local output directory.
+        credentials_file (str): The path to the credentials file.
+        container_id (str, optional): A running container from `start_download_container`.
+            If given, cfmm2tar is run with `docker exec` instead of a new `docker run`.
+        data_root (str, optional): The directory mounted as /data in that container.
+
+    Returns:
+        list: Command list for subprocess to execute.
+    """
+    if _USE_LOCAL:
+        return ["cfmm2tar", "-c", credentials_file, "-u", study_uid, out_dir]
+    if container_id:
+        rel_dir = os.path.relpath(os.path.abspath(out_dir), data_root)
+        return [
+            "docker", "exec", container_id,
+            "cfmm2tar",
+            "-c", "/mysecrets/uwo_credentials",
+            "-u", study_uid,
+            f"/data/{rel_dir}"
+        ]
+    return [
         "docker", "run",
         "--rm",
         "-v", f"{credentials_file}:/mysecrets/uwo_credentials:ro",
@@ -58,85 +292,306 @@ def download_dicom(study, credentials_file, do_cleanup=False, create_dicom_metad
         "/data"
     ]
 
-    print(f"Running Docker command for {sub_label} (Study UID: {study_uid}):")
-    print(" ".join(docker_cmd))
 
-    # Execute the command
-    try:
-        subprocess.run(docker_cmd, check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"[ERROR] Docker command failed for {sub_label} (UID={study_uid}): {e}")
-        return
+def _remove_leftovers(out_dir):
+    """Removes leftover *.attached.tar or *.uid files from out_dir.
 
-    # Optional local cleanup: remove leftover *.attached.tar or *.uid in out_dir
-    if do_cleanup:
-        leftover_files = [
-            f for f in os.listdir(out_dir)
-            if f.endswith(".attached.tar") or f.endswith(".uid")
-        ]
-        for lf in leftover_files:
-            full_path = os.path.join(out_dir, lf)
+    Args:
+        out_dir (str): The download directory.
+
+    Returns:
+        None
+    """
+    messages = []
+    with os.scandir(out_dir) as entries:
+        for entry in entries:
+            if not entry.name.endswith((".attached.tar", ".uid")):
+                continue
             try:
-                os.remove(full_path)
-                print(f"Removed leftover file: {full_path}")
+                os.remove(entry.path)
+                messages.append(f"Removed leftover file: {entry.path}")
             except OSError as e:
-                print(f"[WARNING] Could not remove {full_path}: {e}")
+                messages.append(f"[WARNING] Could not remove {entry.path}: {e}")
+    if messages:
+        _log(*messages)
+
+
+def _record_study_metadata(study):
+    """Stores a downloaded study's demographic data (age/sex) for dicom_metadata.json.
+
+    Args:
+        study (dict): The study dictionary ('sub_label', 'patient_sex', 'patient_age').
+
+    Returns:
+        None
+    """
+    patient_sex = study.get("patient_sex", "")
+    patient_age = study.get("patient_age", "")  # e.g. "065Y"
+    numeric_age = None
+    match = _AGE_RE.search(patient_age)
+    if match:
+        numeric_age = int(match.group(1))
+
+    # Update memory store with current subject's data
+    _store_metadata(study.get("sub_label", "sub-unknown"), {
+        "age": numeric_age,
+        "sex": patient_sex
+    })
+
+
+def _finish_download(study, do_cleanup, create_dicom_metadata):
+    """Runs the local steps that follow a successful download of one study.
+
+    Args:
+        study (dict): The downloaded study ('out_dir', 'sub_label', ...).
+        do_cleanup (bool): Whether to remove leftover temporary files.
+        create_dicom_metadata (bool): Whether to record the study's demographic info.
+
+    Returns:
+        None
+    """
+    # Optional local cleanup: remove leftover *.attached.tar or *.uid in out_dir
+    if do_cleanup:
+        _remove_leftovers(study["out_dir"])
 
     # Optionally collect metadata (e.g., age, sex) into a central JSON file
     if create_dicom_metadata:
-        patient_sex = study.get("patient_sex", "")
-        patient_age = study.get("patient_age", "")  # e.g. "065Y"
-        numeric_age = None
-        match = re.search(r"(\d+)", patient_age)
-        if match:
-            numeric_age = int(match.group(1))
-
-        # Merge any existing metadata file into in-memory store
-        if os.path.isfile(METADATA_FILE):
-            try:
-                with open(METADATA_FILE, "r") as f:
-                    existing_data = json.load(f)
-                    for k, v in existing_data.items():
-                        _collected_metadata[k] = v
-            except (json.JSONDecodeError, OSError) as e:
-                print(f"[WARNING] Could not read/parse {METADATA_FILE}: {e}")
-
-        # Update memory store with current subject's data
-        _collected_metadata[sub_label] = {
-            "age": numeric_age,
-            "sex": patient_sex
-        }
+        _record_study_metadata(study)
 
-        # Ensure directory is created before writing
-        metadata_dir = os.path.dirname(METADATA_FILE)
-        os.makedirs(metadata_dir, exist_ok=True)
+    _log(f"Docker command completed for {study.get('sub_label', 'sub-unknown')}.\n")
+
+
+def download_dicom(study, credentials_file, do_cleanup=False, create_dicom_metadata=False,
+                   quiet=False, container_id=None, data_root=None):
+    """Executes the Docker (or local cfmm2tar) command to download the specified study.
+
+    Optionally removes leftover *.attached.tar or *.uid files if `do_cleanup=True`.
+    If `create_dicom_metadata=True`, collects demographic data (age/sex); it is
+    written to sourcedata/dicom/dicom_metadata.json by `flush_metadata`.
+
+    Args:
+        study (dict): A dictionary containing study metadata, such as 'study_uid' and 'out_dir'.
+            Also may include 'sub_label', 'patient_sex', etc.
+        credentials_file (str): The path to the credentials file to mount into Docker.
+        do_cleanup (bool, optional): Whether to remove leftover temporary files after download.
+        create_dicom_metadata (bool, optional): If True, store demographic info in JSON logs.
+        quiet (bool, optional): If True, discards the container's stdout (used when
+            several downloads run at once).
+        container_id (str, optional): A running container from `start_download_container`
+            to `docker exec` the download into.
+        data_root (str, optional): The directory that container mounts as /data; out_dir
+            must lie inside it.
 
-        def subject_number(label):
-            """Extracts the integer portion from a subject label for sorting purposes.
+    Returns:
+        None
+    """
+    study_uid = study["study_uid"]
+    out_dir = study["out_dir"]
+    sub_label = study.get("sub_label", "sub-unknown")
+
+    # Build the Docker (or local cfmm2tar) command as a list for subprocess
+    docker_cmd = _build_download_cmd(study_uid, out_dir, credentials_file,
+                                     container_id=container_id, data_root=data_root)
+    if container_id:
+        # Nothing mounts out_dir itself, so it has to exist under data_root already
+        os.makedirs(out_dir, exist_ok=True)
 
-            For example, "sub-010" becomes 10, "sub-2" becomes 2, and if no digits are found,
-            a fallback value of 999999999 is returned to ensure such labels sort last.
+    _log(f"Running Docker command for {sub_label} (Study UID: {study_uid}):", " ".join(docker_cmd))
 
-            Args:
-                label (str): The subject label, e.g. "sub-010" or "sub-002_baseline".
+    # Execute the command
+    try:
+        subprocess.run(docker_cmd, executable=_resolve_executable(docker_cmd[0]), check=True,
+                       stdout=subprocess.DEVNULL if quiet else None, **_SPAWN_KWARGS)
+    except subprocess.CalledProcessError as e:
+        _log(f"[ERROR] Docker command failed for {sub_label} (UID={study_uid}): {e}")
+        return
 
-            Returns:
-                int: The numeric portion of the subject label if digits are found, otherwise 999999999.
-            """
-            m = re.search(r"\d+", label)
-            return int(m.group()) if m else 999999999
+    _finish_download(study, do_cleanup, create_dicom_metadata)
 
-        # Gather subjects in ascending numeric order
-        sorted_keys = sorted(_collected_metadata.keys(), key=subject_number)
 
-        # Rebuild a sorted dictionary
-        ordered_data = {k: _collected_metadata[k] for k in sorted_keys}
+async def _download_dicom_async(study, credentials_file, semaphore, do_cleanup,
+                                create_dicom_metadata, container_id, data_root):
+    """Coroutine version of `download_dicom` for use by `download_dicom_many`.
 
-        # Write updated metadata in sorted order
+    Args:
+        study (dict): Study dictionary as accepted by `download_dicom`.
+        credentials_file (str): The path to the credentials file to mount into Docker.
+        semaphore (asyncio.Semaphore): Bounds the number of simultaneous downloads.
+        do_cleanup (bool): Whether to remove leftover temporary files after download.
+        create_dicom_metadata (bool): If True, store demographic info in JSON logs.
+        container_id (str or None): A container from `start_download_container`.
+        data_root (str or None): The directory that container mounts as /data.
+
+    Returns:
+        bool: True if the download succeeded.
+    """
+    study_uid = study["study_uid"]
+    sub_label = study.get("sub_label", "sub-unknown")
+    docker_cmd = _build_download_cmd(study_uid, study["out_dir"], credentials_file,
+                                     container_id=container_id, data_root=data_root)
+    if container_id:
+        os.makedirs(study["out_dir"], exist_ok=True)
+
+    async with semaphore:
+        # Same per-study header as run_dicom_download_command, printed as the study starts
+        _log(*_study_header(study),
+             f"Running Docker command for {sub_label} (Study UID: {study_uid}):",
+             " ".join(docker_cmd))
+        # Container output is discarded so the logs of different studies do not interleave
+        proc = await asyncio.create_subprocess_exec(
+            _resolve_executable(docker_cmd[0]), *docker_cmd[1:],
+            stdout=asyncio.subprocess.DEVNULL
+        )
+        returncode = await proc.wait()
+
+    if returncode != 0:
+        _log(f"[ERROR] Docker command failed for {sub_label} (UID={study_uid}): "
+             f"exit status {returncode}")
+        return False
+    _finish_download(study, do_cleanup, create_dicom_metadata)
+    return True
+
+
+async def _download_dicom_all(studies, credentials_file, max_workers, do_cleanup,
+                              create_dicom_metadata, container_id, data_root):
+    """Runs `_download_dicom_async` for every study, at most max_workers at a time.
+
+    Args:
+        studies (list of dict): Study dictionaries as accepted by `download_dicom`.
+        credentials_file (str): The path to the credentials file to mount into Docker.
+        max_workers (int): Maximum number of simultaneous downloads.
+        do_cleanup (bool): Whether to remove leftover temporary files after download.
+        create_dicom_metadata (bool): If True, store demographic info in JSON logs.
+        container_id (str or None): A container from `start_download_container`.
+        data_root (str or None): The directory that container mounts as /data.
+
+    Returns:
+        None
+    """
+    semaphore = asyncio.Semaphore(max_workers)
+    coros = [
+        _download_dicom_async(study, credentials_file, semaphore, do_cleanup,
+                              create_dicom_metadata, container_id, data_root)
+        for study in studies
+    ]
+    for done, finished in enumerate(asyncio.as_completed(coros), start=1):
+        await finished
+        _log(f"[INFO] ({done}/{len(coros)}) downloads finished.")
+
+
+def download_dicom_many(studies, credentials_file, max_workers=4, do_cleanup=False,
+                        create_dicom_metadata=False, container_id=None, data_root=None):
+    """Downloads several studies concurrently from a single thread with asyncio.
+
+    Each download is an external Docker process, so one event loop can wait on all
+    of them at once; an asyncio.Semaphore bounds how many run simultaneously. This
+    avoids parking one thread per download in a blocking wait.
+
+    Args:
+        studies (list of dict): Study dictionaries as accepted by `download_dicom`.
+        credentials_file (str): The path to the credentials file to mount into Docker.
+        max_workers (int, optional): Maximum number of simultaneous downloads.
+        do_cleanup (bool, optional): Whether to remove leftover temporary files after download.
+        create_dicom_metadata (bool, optional): If True, store demographic info in JSON logs.
+        container_id (str, optional): A running container from `start_download_container`
+            to `docker exec` the downloads into.
+        data_root (str, optional): The directory that container mounts as /data.
+
+    Returns:
+        None
+    """
+    asyncio.run(_download_dicom_all(studies, credentials_file, max(1, max_workers), do_cleanup,
+                                    create_dicom_metadata, container_id, data_root))
+    flush_metadata()
+
+
+def download_dicom_batch(studies, credentials_file, do_cleanup=False, create_dicom_metadata=False,
+                         quiet=False, per_subject=False):
+    """Downloads several studies with one container per output directory (or subject).
+
+    cfmm2tar takes a single UID per call, so the UIDs are written to a list file and
+    looped over by a shell inside one container, paying the Docker startup once per
+    group instead of once per study. With `per_subject`, all sessions of a subject are
+    one group even though each has its own out_dir: the directories' common parent is
+    mounted and every UID is downloaded into its own subdirectory. Studies the batch
+    did not complete (or all of them, if the image cannot run the loop) fall back to
+    `download_dicom`. With a local cfmm2tar, or a single study, `download_dicom` is
+    used directly.
+
+    Args:
+        studies (list of dict): Study dictionaries as accepted by `download_dicom`.
+        credentials_file (str): The path to the credentials file to mount into Docker.
+        do_cleanup (bool, optional): Whether to remove leftover temporary files after download.
+        create_dicom_metadata (bool, optional): If True, store demographic info in JSON logs.
+        quiet (bool, optional): If True, discards the container's stdout.
+        per_subject (bool, optional): If True, groups studies by 'sub_label' instead of
+            by 'out_dir'.
+
+    Returns:
+        None
+    """
+    groups = {}
+    for study in studies:
+        key = study.get("sub_label", "sub-unknown") if per_subject else study["out_dir"]
+        groups.setdefault(key, []).append(study)
+
+    for group in groups.values():
+        out_dirs = list(dict.fromkeys(study["out_dir"] for study in group))
+        if _USE_LOCAL or len(group) == 1:
+            for study in group:
+                _log(*_study_header(study))
+                download_dicom(study, credentials_file, do_cleanup=do_cleanup,
+                               create_dicom_metadata=create_dicom_metadata, quiet=quiet)
+            continue
+
+        data_root = os.path.commonpath([os.path.abspath(d) for d in out_dirs])
+        batch_dir = tempfile.mkdtemp(prefix="dicomatic_batch_")
         try:
-            with open(METADATA_FILE, "w") as f:
-                json.dump(ordered_data, f, indent=2)
-        except OSError as e:
-            print(f"[WARNING] Could not write to {METADATA_FILE}: {e}")
+            with open(os.path.join(batch_dir, "uids.txt"), "w") as f:
+                f.write("".join(
+                    f"{study['study_uid']} "
+                    f"{os.path.relpath(os.path.abspath(study['out_dir']), data_root)}\n"
+                    for study in group
+                ))
+
+            docker_cmd = [
+                "docker", "run",
+                "--rm",
+                "-v", f"{credentials_file}:/mysecrets/uwo_credentials:ro",
+                "-v", f"{data_root}:/data",
+                "-v", f"{batch_dir}:/batch",
+                "--entrypoint", "/bin/sh",
+                "cfmm2tar",
+                "-c", _BATCH_SCRIPT
+            ]
+            # One header per study, as on the per-study path, then the shared command
+            _log(*(line for study in group for line in _study_header(study)),
+                 f"Running batched Docker command for {len(group)} studies in {data_root}:",
+                 " ".join(docker_cmd))
+            subprocess.run(docker_cmd, executable=_resolve_executable("docker"),
+                           stdout=subprocess.DEVNULL if quiet else None, **_SPAWN_KWARGS)
+
+            done_file = os.path.join(batch_dir, "done")
+            done = set()
+            if os.path.isfile(done_file):
+                with open(done_file, "r") as f:
+                    done = {line.strip() for line in f}
+        finally:
+            shutil.rmtree(batch_dir, ignore_errors=True)
+
+        for study in group:
+            sub_label = study.get("sub_label", "sub-unknown")
+            if study["study_uid"] not in done:
+                _log(f"[WARNING] Batch did not download {sub_label} "
+                     f"(UID={study['study_uid']}); retrying on its own.")
+                download_dicom(study, credentials_file, do_cleanup=False,
+                               create_dicom_metadata=create_dicom_metadata, quiet=quiet)
+                continue
+            if create_dicom_metadata:
+                _record_study_metadata(study)
+            _log(f"Docker command completed for {sub_label}.")
 
-    print(f"Docker command completed for {sub_label}.\n")
+        if do_cleanup:
+            for out_dir in out_dirs:
+                _remove_leftovers(out_dir)
+        _log("")
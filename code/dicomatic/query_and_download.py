@@ -11,29 +11,61 @@ Supports three modes:
   3) Match local BIDS subjects/sessions in sourcedata/dicom
 """
 
+import io
 import os
 import re
 import subprocess
 import tempfile
 import atexit
+from collections import defaultdict
+from operator import itemgetter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache, partial
 from getpass import getpass
 
 # External libraries
+import yaml
 from ruamel.yaml import YAML
 
 # Local modules
 from dicom_query import (
     build_findscu_for_description,
     build_findscu_for_patient_name,
-    build_findscu_for_all_studies,
-    run_findscu,
-    parse_studies_with_demographics
+    batch_findscu,
+    stream_findscu,
+    iter_studies,
+    parse_studies_columnar,
+    get_study,
+    stop_container
 )
-from download_dicom import download_dicom
+from download_dicom import (
+    download_dicom,
+    download_dicom_batch,
+    download_dicom_many,
+    start_download_container,
+    _print_lock
+)
+
+# libyaml's C loader when PyYAML was built with it; ruamel is only needed to write
+_YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+# Directory of this script and the project root two levels above it
+_SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+_PROJECT_ROOT = os.path.abspath(os.path.join(_SCRIPT_DIR, "..", ".."))
 
 # Global list to track temporary files for cleanup
 _temp_files = []
 
+# Archive extensions in both cases, so names can be matched without lower-casing each one
+_ARCHIVE_SUFFIXES = (".zip", ".ZIP", ".tar", ".TAR", ".tar.gz", ".tar.GZ", ".TAR.GZ",
+                     ".tgz", ".TGZ")
+
+# First run of digits in a sub-*/ses-* label, used as its numeric sort key
+_DIGITS_RE = re.compile(r'(\d+)')
+
+# Patient-name pattern, e.g. '2023_08_22_001_baseline' -> digits '001', trailing 'baseline'
+_NAME_RE = re.compile(r'^(?:\d{4}_\d{2}_\d{2}_)?(?:[A-Za-z]*-?)?(\d+)(?:_(.*))?$')
+
 
 @atexit.register
 def cleanup_temp_files():
@@ -61,19 +93,22 @@ def create_temp_credentials_file(username, password):
         str: The path to the temporary credentials file.
     """
     fd, path = tempfile.mkstemp(prefix="dicom_creds_", text=True)
-    with os.fdopen(fd, 'w') as f:
-        f.write(username + "\n" + password + "\n")
+    try:
+        # mkstemp already creates the file 0600; make it explicit for the password
+        os.fchmod(fd, 0o600)
+        os.write(fd, f"{username}\n{password}\n".encode("utf-8"))
+    finally:
+        os.close(fd)
     _temp_files.append(path)
     return path
 
 
-def get_credentials(script_dir, config, debug=False):
+def get_credentials(config, debug=False):
     """Retrieves credentials from a .secrets file if present/valid,
     otherwise falls back to values from `config.yaml` or prompts for
     credentials.
 
     Args:
-        script_dir (str): The directory of the current script.
         config (dict): The loaded configuration dictionary.
         debug (bool, optional): If True, prints debug information. Defaults to False.
 
@@ -84,8 +119,7 @@ def get_credentials(script_dir, config, debug=False):
             - str: The password.
             - str or None: The path to the secrets file if used, otherwise None.
     """
-    project_root = os.path.abspath(os.path.join(script_dir, "..", ".."))
-    secrets_file = os.path.join(project_root, ".secrets", "uwo_credentials")
+    secrets_file = os.path.join(_PROJECT_ROOT, ".secrets", "uwo_credentials")
 
     username = config["dicom"]["username"]
     password = config["dicom"]["password"]
@@ -203,6 +237,33 @@ def maybe_save_new_server_settings(config, config_path, changed_server_settings,
         print("[INFO] Server settings changes were not saved.")
 
 
+def parse_subject_and_trailing(dicom_patient_name, valid_digits=None):
+    """Parses the subject label and trailing substring of a DICOM patient name in one match.
+
+    For example, '2023_08_22_001_baseline' -> ('sub-001', 'baseline').
+
+    Args:
+        dicom_patient_name (str): The patient name from the DICOM record.
+        valid_digits (set, optional): If given, only these subject digits (e.g. {'001'})
+            are accepted; other names are rejected before any label is built.
+
+    Returns:
+        tuple: (sub_label, trailing), where sub_label is 'sub-XXX' or None if the
+        name does not match, and trailing is the trailing substring or None.
+    """
+    # A name without any digit (e.g. 'Doe^John') can never match; reject it before
+    # entering the regex engine
+    if not dicom_patient_name or not any(map(str.isdigit, dicom_patient_name)):
+        return None, None
+    match = _NAME_RE.match(dicom_patient_name)
+    if not match:
+        return None, None
+    digits = match.group(1)
+    if valid_digits is not None and digits not in valid_digits:
+        return None, None
+    return f"sub-{digits}", match.group(2)
+
+
 def parse_subject_digits(dicom_patient_name):
     """Parses the subject digits from a DICOM patient name.
 
@@ -214,14 +275,7 @@ def parse_subject_digits(dicom_patient_name):
     Returns:
         str or None: A string with the format 'sub-XXX' if found, otherwise None.
     """
-    pattern = r'^(?:\d{4}_\d{2}_\d{2}_)?(?:[A-Za-z]*-?)?(\d+)(?:_.*)?$'
-    match = re.match(pattern, dicom_patient_name)
-    if not match:
-        return None
-    digits = match.group(1)
-    if not digits:
-        return None
-    return f"sub-{digits}"
+    return parse_subject_and_trailing(dicom_patient_name)[0]
 
 
 def parse_trailing_substring(dicom_patient_name):
@@ -235,11 +289,7 @@ def parse_trailing_substring(dicom_patient_name):
     Returns:
         str or None: The trailing substring if available, otherwise None.
     """
-    pattern = r'^(?:\d{4}_\d{2}_\d{2}_)?(?:[A-Za-z]*-?)?\d+(?:_(.*))?$'
-    match = re.match(pattern, dicom_patient_name)
-    if not match:
-        return None
-    return match.group(1)
+    return parse_subject_and_trailing(dicom_patient_name)[1]
 
 
 def find_session_label(sub_label, trailing, session_map=None):
@@ -268,6 +318,42 @@ def find_session_label(sub_label, trailing, session_map=None):
     return None
 
 
+def group_studies_by_subject(studies_list):
+    """Groups studies by the subject label parsed from their patient names.
+
+    Each study also gets a 'sub_label' (unless it already has one); studies whose
+    names carry no subject number are grouped under 'sub-unknown'.
+
+    Args:
+        studies_list (list of dict): The studies to group, in the order sessions
+            should be numbered.
+
+    Returns:
+        dict: Maps each subject label to a list of (study, trailing substring) tuples.
+    """
+    grouped = defaultdict(list)
+    for s in studies_list:
+        sub_label, trailing = parse_subject_and_trailing(s["patient_name"])
+        sub_label = sub_label or "sub-unknown"
+        s.setdefault("sub_label", sub_label)
+        grouped[sub_label].append((s, trailing))
+    return grouped
+
+
+@lru_cache(maxsize=None)
+def sub_numeric_key(s):
+    """Sort key for subject labels: 'sub-002' -> 2; labels without digits sort last."""
+    match = _DIGITS_RE.search(s)
+    return int(match.group(1)) if match else 999999
+
+
+@lru_cache(maxsize=None)
+def ses_numeric_key(s):
+    """Sort key for session labels: 'ses-01' -> 1; labels without digits sort last."""
+    match = _DIGITS_RE.search(s)
+    return int(match.group(1)) if match else 999999
+
+
 def prompt_yes_no(question):
     """Prompts for a yes/no response.
 
@@ -292,27 +378,25 @@ def list_subject_folders(bids_root):
 
     Returns:
         dict: A dictionary where keys are subject folder names (e.g. 'sub-001')
-              and values are lists of session folder names (e.g. ['ses-01', 'ses-02']).
+              and values are sets of session folder names (e.g. {'ses-01', 'ses-02'}),
+              so session lookups are constant time.
     """
     subjects_dict = {}
     if not os.path.isdir(bids_root):
         return subjects_dict
 
-    for sub_name in os.listdir(bids_root):
-        if not sub_name.startswith("sub-"):
-            continue
-        sub_path = os.path.join(bids_root, sub_name)
-        if not os.path.isdir(sub_path):
-            continue
+    with os.scandir(bids_root) as sub_entries:
+        for sub_entry in sub_entries:
+            if not sub_entry.name.startswith("sub-") or not sub_entry.is_dir():
+                continue
 
-        sessions = []
-        for ses_name in os.listdir(sub_path):
-            if ses_name.startswith("ses-"):
-                ses_path = os.path.join(sub_path, ses_name)
-                if os.path.isdir(ses_path):
-                    sessions.append(ses_name)
+            with os.scandir(sub_entry.path) as ses_entries:
+                sessions = {
+                    ses_entry.name for ses_entry in ses_entries
+                    if ses_entry.name.startswith("ses-") and ses_entry.is_dir()
+                }
 
-        subjects_dict[sub_name] = sessions
+            subjects_dict[sub_entry.name] = sessions
 
     return subjects_dict
 
@@ -321,26 +405,130 @@ def print_studies_info(studies, show_mapping=False):
     """Prints a list of DICOM studies with optional subject/session mapping.
 
     Args:
-        studies (list of dict): A list of study dictionaries to display.
+        studies (iterable of dict): The study dictionaries to display, in order (e.g. a
+            generator of `get_study` results for columnar output).
         show_mapping (bool, optional): If True, prints mapping info like sub-label, ses-label.
     """
+    # Collected first and written in one go rather than flushed line by line
+    buf = io.StringIO()
     for i, st in enumerate(studies, start=1):
-        print(f"--- Study #{i} ---")
-        print(f"  Study Date:        {st['study_date']}")
-        print(f"  Patient Name:      {st['patient_name']}")
-        print(f"  Patient ID:        {st['patient_id']}")
-        print(f"  Study Description: {st['study_description']}")
-        print(f"  Patient Sex:       {st['patient_sex']}")
-        print(f"  Patient Age:       {st['patient_age']}")
-        print(f"  StudyInstanceUID:  {st['study_uid']}")
-        print("")
+        print(f"--- Study #{i} ---", file=buf)
+        print(f"  Study Date:        {st['study_date']}", file=buf)
+        print(f"  Patient Name:      {st['patient_name']}", file=buf)
+        print(f"  Patient ID:        {st['patient_id']}", file=buf)
+        print(f"  Study Description: {st['study_description']}", file=buf)
+        print(f"  Patient Sex:       {st['patient_sex']}", file=buf)
+        print(f"  Patient Age:       {st['patient_age']}", file=buf)
+        print(f"  StudyInstanceUID:  {st['study_uid']}", file=buf)
+        print("", file=buf)
+    print(buf.getvalue(), end="", flush=True)
+
+
+def study_date_order(study_dates):
+    """Returns the positions of a StudyDate column sorted oldest first.
+
+    Args:
+        study_dates (list of str): The 'study_date' column (YYYYMMDD strings).
+
+    Returns:
+        list of int: Positions into the column; studies without a valid date come first.
+    """
+    date_ints = [int(d) if (d and d.isdigit()) else 0 for d in study_dates]
+    return sorted(range(len(date_ints)), key=date_ints.__getitem__)
+
+
+def sort_studies_by_date(studies):
+    """Sorts studies in place by StudyDate, oldest first.
+
+    The integer date is computed once per study and stored under '_date_int', so the
+    sort itself only needs an itemgetter. Studies without a valid date sort first.
+
+    Args:
+        studies (list of dict): Studies as returned by `iter_studies`.
+
+    Returns:
+        None
+    """
+    for st in studies:
+        d = st["study_date"]
+        st["_date_int"] = int(d) if (d and d.isdigit()) else 0
+    studies.sort(key=itemgetter("_date_int"))
+
+
+def scan_existing_archives(out_dir):
+    """Lists the archive files (.zip, .tar, .tar.gz, .tgz) already present in a directory.
+
+    Args:
+        out_dir (str): The directory to scan.
+
+    Returns:
+        set: Archive file names; empty if the directory does not exist.
+    """
+    if not os.path.isdir(out_dir):
+        return set()
+    with os.scandir(out_dir) as entries:
+        return {entry.name for entry in entries if entry.name.endswith(_ARCHIVE_SUFFIXES)}
+
+
+def skip_existing_download(study, existing_archives=None):
+    """Checks for an existing archive of a study and reports that it will be skipped.
+
+    Mode 3 downloads each study into its own sub-*/ses-* folder, so any archive
+    already in out_dir counts as that study's.
+
+    Args:
+        study (dict): The study ('sub_label', 'ses_label', 'out_dir', ...).
+        existing_archives (set, optional): Archive names already found in out_dir; if
+            None, out_dir is scanned here.
+
+    Returns:
+        bool: True if the study already has an archive and should not be downloaded.
+    """
+    sub_label = study["sub_label"]
+    ses_label = study["ses_label"]
+    out_dir = study["out_dir"]
+    if existing_archives is None:
+        existing_archives = scan_existing_archives(out_dir)
+    if not existing_archives:
+        return False
+    cap_sub_str = f"Sub-{sub_label[4:]}" if sub_label.startswith("sub-") else sub_label
+    skip_combo_str = f"{cap_sub_str}_{ses_label}"
+    with _print_lock:
+        print(f"WARNING: {skip_combo_str} has existing archives in {out_dir}\n"
+              f"Skipping {skip_combo_str}.\n")
+    return True
+
+
+def drop_existing_downloads(studies):
+    """Removes the studies that already have an archive from a download list.
+
+    Each output directory is scanned once, however many studies share it.
+
+    Args:
+        studies (list of dict): The studies to download.
+
+    Returns:
+        list of dict: The studies still to download, in their original order.
+    """
+    archives_by_dir = {}
+    remaining = []
+    for st in studies:
+        out_dir = st["out_dir"]
+        archives = archives_by_dir.get(out_dir)
+        if archives is None:
+            archives = archives_by_dir[out_dir] = scan_existing_archives(out_dir)
+        if not skip_existing_download(st, archives):
+            remaining.append(st)
+    return remaining
 
 
 def run_dicom_download_command(study,
                                credentials_file,
                                do_cleanup=False,
                                check_existing_archives=False,
-                               create_dicom_metadata=False):
+                               create_dicom_metadata=False,
+                               container_id=None,
+                               data_root=None):
     """Runs the Docker-based download command for a single DICOM study.
 
     Args:
@@ -348,99 +536,219 @@ def run_dicom_download_command(study,
                       'ses_label', 'out_dir', etc.).
         credentials_file (str): The path to the credentials file.
         do_cleanup (bool, optional): If True, leftover files (e.g. .attached.tar) are removed.
-        check_existing_archives (bool, optional): If True, checks for existing archives
-            in out_dir before downloading.
+        check_existing_archives (bool, optional): If True, skips the download when out_dir
+            already holds an archive (see `skip_existing_download`).
         create_dicom_metadata (bool, optional): If True, writes basic metadata (age/sex)
             into dicom_metadata.json.
+        container_id (str, optional): A persistent cfmm2tar container to `docker exec`
+            the download into (see `start_download_container`).
+        data_root (str, optional): The directory that container mounts as /data.
 
     Returns:
         None
     """
     sub_label = study["sub_label"]
     ses_label = study["ses_label"]
-    out_dir = study["out_dir"]
 
-    print(f"Subject:    {sub_label}   | Session: {ses_label}")
-    print("--------------------------------------------------")
+    with _print_lock:
+        print(f"Subject:    {sub_label}   | Session: {ses_label}\n"
+              "--------------------------------------------------")
 
     # Check for existing archives
-    if check_existing_archives and os.path.isdir(out_dir):
-        archives = [f for f in os.listdir(out_dir)
-                    if f.lower().endswith((".zip", ".tar", ".tar.gz", ".tgz"))]
-        if archives:
-            cap_sub_str = f"Sub-{sub_label[4:]}" if sub_label.startswith("sub-") else sub_label
-            skip_combo_str = f"{cap_sub_str}_{ses_label}"
-            print(f"WARNING: {skip_combo_str} has existing archives in {out_dir}")
-            print(f"Skipping {skip_combo_str}.\n")
-            return
+    if check_existing_archives and skip_existing_download(study):
+        return
 
     # Actually run the Docker download (subprocess) via download_dicom(...)
     download_dicom(
         study,
         credentials_file,
         do_cleanup=do_cleanup,
-        create_dicom_metadata=create_dicom_metadata
+        create_dicom_metadata=create_dicom_metadata,
+        container_id=container_id,
+        data_root=data_root
     )
 
 
-def main():
-    """Main entry point for the DICOM Query & Download tool.
+def run_dicom_downloads(studies, credentials_file, max_workers=1, batch_per_subject=False,
+                        do_cleanup=False, check_existing_archives=False,
+                        create_dicom_metadata=False):
+    """Downloads several studies, up to max_workers at a time.
 
-    Provides a menu-driven interface for various query modes:
-      1) By StudyDescription
-      2) By PatientName
-      3) By local BIDS subjects in /sourcedata/dicom
+    Downloads are independent, network-bound Docker calls, so when more than one worker
+    is allowed they run concurrently (see `download_dicom_many`) and progress is
+    printed as each one completes. The downloads are `docker exec`'d into one persistent
+    cfmm2tar container. With `batch_per_subject`, all sessions of a subject are fetched
+    by one container each instead (see `download_dicom_batch`) and a thread pool runs
+    the subjects.
+
+    Args:
+        studies (list of dict): The studies to download (each with 'out_dir' set).
+        credentials_file (str): The path to the credentials file.
+        max_workers (int, optional): Maximum number of simultaneous downloads.
+        batch_per_subject (bool, optional): If True, downloads each subject's sessions
+            in a single container.
+        do_cleanup (bool, optional): If True, leftover files (e.g. .attached.tar) are removed.
+        check_existing_archives (bool, optional): If True, studies that already have an
+            archive in their out_dir are skipped.
+        create_dicom_metadata (bool, optional): If True, writes basic metadata (age/sex)
+            into dicom_metadata.json.
 
     Returns:
         None
     """
-    script_dir = os.path.dirname(__file__)
-    config_path = os.path.join(script_dir, "config.yaml")
+    if check_existing_archives:
+        # Settled here, before any container is started
+        studies = drop_existing_downloads(studies)
+    if batch_per_subject:
+        jobs = {}
+        for st in studies:
+            jobs.setdefault(st["sub_label"], []).append(st)
+        # Container output is only hidden when subjects actually download side by side
+        quiet = max_workers > 1 and len(jobs) > 1
+        tasks = [
+            (partial(download_dicom_batch, group, credentials_file, do_cleanup=do_cleanup,
+                     create_dicom_metadata=create_dicom_metadata, quiet=quiet,
+                     per_subject=True),
+             f"{sub_label} ({len(group)} session(s))")
+            for sub_label, group in jobs.items()
+        ]
+        _run_download_tasks(tasks, max_workers)
+        return
 
-    print("\n[==== DICOMATIC - DICOM Query & Download ====]")
-    print("        A DICOM Query & Download Tool")
+    # One idle cfmm2tar container serves every study through docker exec
+    container_id = data_root = None
+    if len(studies) > 1:
+        data_root = os.path.commonpath([os.path.abspath(st["out_dir"]) for st in studies])
+        container_id = start_download_container(credentials_file, data_root)
+    try:
+        if max_workers > 1 and len(studies) > 1:
+            # The downloads are external processes: one asyncio loop waits on all of them
+            download_dicom_many(studies, credentials_file, max_workers=max_workers,
+                                do_cleanup=do_cleanup,
+                                create_dicom_metadata=create_dicom_metadata,
+                                container_id=container_id, data_root=data_root)
+        else:
+            for st in studies:
+                run_dicom_download_command(st, credentials_file, do_cleanup=do_cleanup,
+                                           create_dicom_metadata=create_dicom_metadata,
+                                           container_id=container_id, data_root=data_root)
+    finally:
+        if container_id:
+            stop_container(container_id)
 
-    ruamel_yaml = YAML()
-    ruamel_yaml.preserve_quotes = True
 
-    with open(config_path, "r") as f:
-        config = ruamel_yaml.load(f)
+def _run_download_tasks(tasks, max_workers):
+    """Runs download callables one by one, or on a thread pool reporting progress.
 
-    debug = False  # Set to True for verbose logs
+    Args:
+        tasks (list of tuple): (callable, label) pairs; the label names the download
+            in progress messages.
+        max_workers (int): Maximum number of simultaneous downloads.
 
-    # 1) Credentials
-    use_secrets_file, username, password, secrets_file_path = get_credentials(script_dir, config, debug=debug)
-    config["dicom"]["username"] = username
-    config["dicom"]["password"] = password
+    Returns:
+        None
+    """
+    if max_workers <= 1 or len(tasks) <= 1:
+        for task, _ in tasks:
+            task()
+        return
 
-    # 2) Server info
-    dicom_config = config["dicom"]
-    changed_server_settings = prompt_for_server_info(dicom_config, debug=debug)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(task): label for task, label in tasks}
+        # Report each download as it finishes rather than in submission order
+        for done, future in enumerate(as_completed(futures), start=1):
+            future.result()
+            with _print_lock:
+                print(f"[INFO] ({done}/{len(futures)}) Finished {futures[future]}.")
 
-    # 3) Create temp credentials file if needed
-    if use_secrets_file:
-        credentials_file = secrets_file_path
-    else:
-        credentials_file = create_temp_credentials_file(username, password)
-        if debug:
-            print(f"[DEBUG] Created temporary credentials file: {credentials_file}")
 
+def prompt_sessions_per_subject(subjects, sorted_ses_by_sub):
+    """Asks which sessions to download for each subject, all prompts in one go.
+
+    Every subject's available sessions are listed first, then one answer per subject
+    is read back to back, so the answers can also be typed ahead or piped in.
+
+    Args:
+        subjects (list of str): Subject labels to ask about (e.g. ['sub-001']).
+        sorted_ses_by_sub (dict): Maps each known subject to its sorted session labels.
+
+    Returns:
+        dict: Maps each known subject to its (stripped) answer; an empty answer means
+        all sessions. Unknown subjects are reported and left out.
+    """
+    known_subjects = []
+    for subj in subjects:
+        if subj not in sorted_ses_by_sub:
+            print(f"{subj} not found in matched studies. Skipping.\n")
+            continue
+        known_subjects.append(subj)
+    if not known_subjects:
+        return {}
+
+    print("Enter the sessions to download for each subject (space-separated),")
+    print("or press Enter for all of them. Available sessions:")
+    for subj in known_subjects:
+        print(f"  {subj}: {' '.join(sorted_ses_by_sub[subj])}")
+    print("")
+    return {subj: input(f"{subj}> ").strip() for subj in known_subjects}
+
+
+def valid_sessions(subj, requested_sessions, ses_map):
+    """Keeps the requested sessions that exist for a subject, reporting the others.
+
+    Args:
+        subj (str): The subject label (only used in the message).
+        requested_sessions (list of str): Session labels asked for, in order.
+        ses_map (dict): The subject's sessions (session label -> study).
+
+    Returns:
+        list of str: The requested sessions present in ses_map, in request order,
+        each listed once.
+    """
+    chosen = []
+    for ses in dict.fromkeys(requested_sessions):
+        if ses in ses_map:
+            chosen.append(ses)
+        else:
+            print(f"  Session {ses} not found for {subj}. Skipping.\n")
+    return chosen
+
+
+def _run_plan(plan, download):
+    """Downloads a mode 3 plan between the usual start and completion banners.
+
+    Args:
+        plan (list of dict): The studies to download, in order.
+        download (callable): Downloads a list of studies (`run_dicom_downloads` with
+            its settings already bound).
+
+    Returns:
+        None
+    """
+    print("\n============== RUNNING DICOMATIC DOCKER COMMANDS  ==============\n")
+    download(plan)
+    print("\nAll docker operations have been completed.\n")
+
+
+def _run_query_mode(choice, config, download_studies, debug=False):
+    """Runs the query (and optional download) of the chosen menu mode.
+
+    Args:
+        choice (str): The menu choice, '1', '2' or '3'.
+        config (dict): The loaded configuration dictionary, with credentials and server
+            settings already filled in.
+        download_studies (callable): Downloads a list of studies (`run_dicom_downloads`
+            with the shared settings already bound).
+        debug (bool, optional): If True, prints the findscu commands and dumps their
+            output.
+
+    Returns:
+        bool: True if the query returned studies, False otherwise.
+    """
+    dicom_config = config["dicom"]
     session_map = config.get("session_map", {})
     query_tags = config["dicom_query_tags"]
     tag_map = config["dicom_tag_map"]
-    create_dicom_metadata = config.get("create_dicom_metadata", False)
-
-    # Menu selection
-    while True:
-        print("\nWhich query+download mode do you want?")
-        print(" 1) By StudyDescription (list multiple studies)")
-        print(" 2) By PatientName (search for a specific participant)")
-        print(" 3) By local BIDS subjects in /sourcedata/dicom\n")
-        choice = input("Enter 1, 2, or 3.\n> ").strip()
-        if choice in ("1", "2", "3"):
-            break
-        print("Invalid choice. Please enter '1', '2', or '3'.")
-
     query_was_successful = False
 
     # ============================
@@ -452,8 +760,7 @@ def main():
             study_desc = input("Enter StudyDescription to search for: ").strip()
             if not study_desc:
                 print("No StudyDescription provided. Exiting.")
-                maybe_save_new_server_settings(config, config_path, changed_server_settings, False)
-                return
+                return query_was_successful
 
         cmd = build_findscu_for_description(
             container=dicom_config["container"],
@@ -466,63 +773,49 @@ def main():
             study_description=study_desc,
             query_tags=query_tags
         )
-        output = run_findscu(cmd, debug=False)
-        if not output:
-            print("No output from findscu. Exiting.")
-            maybe_save_new_server_settings(config, config_path, changed_server_settings, False)
-            return
-
-        studies = parse_studies_with_demographics(output, tag_map)
-        if not studies:
+        columns = parse_studies_columnar(stream_findscu(cmd, debug=debug, verbose=debug), tag_map)
+        num_studies = len(columns["study_uid"])
+        if not num_studies:
             print(f"No studies found with StudyDescription='{study_desc}'.")
-            maybe_save_new_server_settings(config, config_path, changed_server_settings, False)
-            return
+            return query_was_successful
 
         query_was_successful = True
-        print(f"\nFound {len(studies)} studies with description '{study_desc}':")
+        print(f"\nFound {num_studies} studies with description '{study_desc}':")
 
-        def date_to_int(d):
-            return int(d) if (d and d.isdigit()) else 0
-
-        studies.sort(key=lambda st: date_to_int(st["study_date"]))
-        print_studies_info(studies, show_mapping=False)
+        # Studies are listed one dict at a time; only those picked below are kept
+        order = study_date_order(columns["study_date"])
+        print_studies_info(get_study(columns, j) for j in order)
 
         download_prompt = prompt_yes_no("Would you like to download these studies now? (y/n): ")
         if download_prompt == "n":
             print("No downloads selected. Exiting.\n")
-            maybe_save_new_server_settings(config, config_path, changed_server_settings, True)
-            return
+            return query_was_successful
 
         print("Select studies by number, exact patient name, or StudyInstanceUID (space separated).")
         user_line = input("> ").strip()
         if not user_line:
             print("No studies selected. Exiting.")
-            maybe_save_new_server_settings(config, config_path, changed_server_settings, True)
-            return
+            return query_was_successful
 
-        index_map = {}
-        name_map = {}
+        patient_names = columns["patient_name"]
+        study_uids = columns["study_uid"]
+        name_map = defaultdict(list)
         uid_map = {}
-        for idx, st in enumerate(studies, start=1):
-            index_map[idx] = st
-            pname = st["patient_name"]
-            uid = st["study_uid"]
-            name_map.setdefault(pname, []).append(idx)
-            uid_map[uid] = idx
+        for idx, j in enumerate(order, start=1):
+            name_map[patient_names[j]].append(idx)
+            uid_map[study_uids[j]] = idx
 
         matched_indices = set()
         tokens = user_line.split()
         for token in tokens:
             # Try integer index
-            try:
+            if token.isdecimal():
                 num = int(token)
-                if 1 <= num <= len(studies):
+                if 1 <= num <= num_studies:
                     matched_indices.add(num)
                 else:
                     print(f"  [WARNING] No study with index {num}. Skipping.")
                 continue
-            except ValueError:
-                pass
 
             # Check name
             if token in name_map:
@@ -539,27 +832,16 @@ def main():
 
         if not matched_indices:
             print("No valid matches found. Exiting.")
-            maybe_save_new_server_settings(config, config_path, changed_server_settings, True)
-            return
+            return query_was_successful
 
-        selected_studies = [index_map[i] for i in sorted(matched_indices)]
+        selected_studies = [get_study(columns, order[i - 1]) for i in sorted(matched_indices)]
 
         # Group by subject to assign sessions
-        def group_studies_by_subject(studies_list):
-            grouped = {}
-            for s in studies_list:
-                sname = s["patient_name"]
-                sub_label = parse_subject_digits(sname) or "sub-unknown"
-                s.setdefault("sub_label", sub_label)
-                grouped.setdefault(sub_label, []).append(s)
-            return grouped
-
         grouped = group_studies_by_subject(selected_studies)
+        # Studies are already in date order and grouping keeps that order
         for sub, stlist in grouped.items():
-            stlist.sort(key=lambda x: date_to_int(x["study_date"]))
             ses_counter = 1
-            for s in stlist:
-                trailing = parse_trailing_substring(s["patient_name"])
+            for s, trailing in stlist:
                 maybe_ses = find_session_label(sub, trailing, session_map=session_map)
                 if maybe_ses is None:
                     maybe_ses = f"ses-{ses_counter:02d}"
@@ -567,24 +849,16 @@ def main():
                 s["ses_label"] = maybe_ses
 
         # Setup output directory
-        project_root = os.path.abspath(os.path.join(script_dir, "..", ".."))
-        tar_dir = os.path.join(project_root, "sourcedata", "tar")
+        tar_dir = os.path.join(_PROJECT_ROOT, "sourcedata", "tar")
         os.makedirs(tar_dir, exist_ok=True)
 
         print("\n============== RUNNING DICOMATIC DOCKER COMMANDS  ==============\n")
 
         for s in selected_studies:
             s["out_dir"] = tar_dir
-            run_dicom_download_command(
-                s,
-                credentials_file,
-                do_cleanup=False,
-                check_existing_archives=False,
-                create_dicom_metadata=create_dicom_metadata
-            )
+        download_studies(selected_studies)
 
         print("All docker operations have been completed.\n")
-        maybe_save_new_server_settings(config, config_path, changed_server_settings, True)
 
     # ========================
     # MODE 2: By PatientName
@@ -595,8 +869,7 @@ def main():
             patient_name = input("Enter PatientName to search for: ").strip()
             if not patient_name:
                 print("No PatientName provided. Exiting.")
-                maybe_save_new_server_settings(config, config_path, changed_server_settings, False)
-                return
+                return query_was_successful
 
         cmd = build_findscu_for_patient_name(
             container=dicom_config["container"],
@@ -609,88 +882,64 @@ def main():
             patient_name=patient_name,
             query_tags=query_tags
         )
-        output = run_findscu(cmd, debug=False)
-        if not output:
-            print("No output from findscu. Exiting.")
-            maybe_save_new_server_settings(config, config_path, changed_server_settings, False)
-            return
-
-        studies = parse_studies_with_demographics(output, tag_map)
-        if not studies:
+        columns = parse_studies_columnar(stream_findscu(cmd, debug=debug, verbose=debug), tag_map)
+        num_studies = len(columns["study_uid"])
+        if not num_studies:
             print(f"No studies found for PatientName='{patient_name}'.")
-            maybe_save_new_server_settings(config, config_path, changed_server_settings, False)
-            return
+            return query_was_successful
 
         query_was_successful = True
-        print(f"\nFound {len(studies)} studies for PatientName '{patient_name}':")
+        print(f"\nFound {num_studies} studies for PatientName '{patient_name}':")
 
-        def date_to_int(d):
-            return int(d) if (d and d.isdigit()) else 0
-
-        studies.sort(key=lambda st: date_to_int(st["study_date"]))
-        print_studies_info(studies, show_mapping=False)
+        order = study_date_order(columns["study_date"])
+        print_studies_info(get_study(columns, j) for j in order)
 
         download_prompt = prompt_yes_no("Download ALL these studies now? (y/n): ")
         if download_prompt == "n":
             print("No downloads selected. Exiting.\n")
-            maybe_save_new_server_settings(config, config_path, changed_server_settings, True)
-            return
+            return query_was_successful
 
-        # Group by subject
-        def group_studies_by_subject(studies_list):
-            grouped = {}
-            for s in studies_list:
-                sname = s["patient_name"]
-                sub_label = parse_subject_digits(sname) or "sub-unknown"
-                s.setdefault("sub_label", sub_label)
-                grouped.setdefault(sub_label, []).append(s)
-            return grouped
+        # All studies are downloaded, so every one needs its dictionary now
+        studies = [get_study(columns, j) for j in order]
 
+        # Group by subject
         grouped = group_studies_by_subject(studies)
+        # Studies are already in date order and grouping keeps that order
         for sub, stlist in grouped.items():
-            stlist.sort(key=lambda x: date_to_int(x["study_date"]))
             ses_counter = 1
-            for s in stlist:
-                trailing = parse_trailing_substring(s["patient_name"])
+            for s, trailing in stlist:
                 maybe_ses = find_session_label(sub, trailing, session_map=session_map)
                 if maybe_ses is None:
                     maybe_ses = f"ses-{ses_counter:02d}"
                     ses_counter += 1
                 s["ses_label"] = maybe_ses
 
-        project_root = os.path.abspath(os.path.join(script_dir, "..", ".."))
-        tar_dir = os.path.join(project_root, "sourcedata", "tar")
+        tar_dir = os.path.join(_PROJECT_ROOT, "sourcedata", "tar")
         os.makedirs(tar_dir, exist_ok=True)
 
         print("\n============== RUNNING DICOMATIC DOCKER COMMANDS  ==============\n")
         for s in studies:
             s["out_dir"] = tar_dir
-            run_dicom_download_command(
-                s,
-                credentials_file,
-                do_cleanup=False,
-                check_existing_archives=False,
-                create_dicom_metadata=create_dicom_metadata
-            )
+        download_studies(studies)
 
         print("All docker operations have been completed.\n")
-        maybe_save_new_server_settings(config, config_path, changed_server_settings, True)
 
     # ==========================================
     # MODE 3: By local BIDS subjects in Dicom/
     # ==========================================
     elif choice == "3":
-        project_root = os.path.abspath(os.path.join(script_dir, "..", ".."))
-        bids_root = os.path.join(project_root, "sourcedata", "dicom")
+        bids_root = os.path.join(_PROJECT_ROOT, "sourcedata", "dicom")
         print(f"[INFO] Searching for sub-* folders in: {bids_root}")
 
         subjects_dict = list_subject_folders(bids_root)
         if not subjects_dict:
             print(f"No sub-* folders found in {bids_root}. Exiting.")
-            maybe_save_new_server_settings(config, config_path, changed_server_settings, False)
-            return
+            return query_was_successful
 
-        cmd = build_findscu_for_all_studies(
+        # One PatientName query per local subject, all run in a single container,
+        # instead of listing every study on the server and filtering here.
+        subject_patterns = [f"*{label.split('-', 1)[-1]}*" for label in sorted(subjects_dict)]
+        output_lines = batch_findscu(
             container=dicom_config["container"],
             bind=dicom_config["bind"],
             server=dicom_config["server"],
@@ -698,36 +947,35 @@ def main():
             tls=dicom_config["tls"],
             username=dicom_config["username"],
             password=dicom_config["password"],
-            query_tags=query_tags
+            query_tags=query_tags,
+            match_key="PatientName",
+            match_values=subject_patterns,
+            debug=debug,
+            verbose=debug
         )
-        output = run_findscu(cmd, debug=False)
-        if not output:
-            maybe_save_new_server_settings(config, config_path, changed_server_settings, False)
-            return
-
-        all_studies = parse_studies_with_demographics(output, tag_map)
-        if not all_studies:
-            print("No studies found in DICOM query.")
-            maybe_save_new_server_settings(config, config_path, changed_server_settings, False)
-            return
 
-        query_was_successful = True
+        # Studies are filtered as findscu streams them in. Wildcard patterns can
+        # overlap (e.g. *01* and *001*), so repeated studies are dropped.
+        seen_uids = set()
         matched_studies = []
-        for st in all_studies:
-            dicom_name = st["patient_name"]
-            sub_label = parse_subject_digits(dicom_name)
-            if not sub_label:
+        # Subject digits of the local folders, checked before a label is built
+        local_digits = {label[4:] for label in subjects_dict}
+        for st in iter_studies(output_lines, tag_map):
+            if st["study_uid"] in seen_uids:
                 continue
-            if sub_label not in subjects_dict:
+            seen_uids.add(st["study_uid"])
+
+            sub_label, trailing = parse_subject_and_trailing(st["patient_name"],
+                                                             valid_digits=local_digits)
+            if not sub_label:
                 continue
 
-            trailing = parse_trailing_substring(dicom_name)
             session_label = find_session_label(sub_label, trailing, session_map=session_map)
             if session_label is None:
                 # Fallback: if trailing is exactly 'ses-XXX'
-                possible_ses_list = subjects_dict[sub_label]
+                possible_sessions = subjects_dict[sub_label]
                 trailing_lower = trailing.lower().strip() if trailing else ""
-                if trailing_lower in possible_ses_list:
+                if trailing_lower in possible_sessions:
                     session_label = trailing_lower
                 else:
                     continue
@@ -741,18 +989,19 @@ def main():
             st["out_dir"] = out_dir
             matched_studies.append(st)
 
+        if not seen_uids:
+            print("No studies found in DICOM query.")
+            return query_was_successful
+
         studies = matched_studies
         print(f"\nFound {len(studies)} studies matching local BIDS subjects/sessions.")
 
-        def date_to_int(d):
-            return int(d) if (d and d.isdigit()) else 0
-        studies.sort(key=lambda st: date_to_int(st["study_date"]))
+        sort_studies_by_date(studies)
 
         print_studies_info(studies, show_mapping=True)
 
         if not studies:
-            maybe_save_new_server_settings(config, config_path, changed_server_settings, False)
-            return
+            return query_was_successful
 
         query_was_successful = True
         subject_dict = {}
@@ -761,158 +1010,176 @@ def main():
             sess = st["ses_label"]
             subject_dict.setdefault(subj, {})[sess] = st
 
-        print("\nThe following subjects and sessions are available:\n")
-
-        def sub_numeric_key(s):
-            try:
-                return int(s.replace("sub-", ""))
-            except ValueError:
-                return 999999
-
-        def ses_numeric_key(s):
-            try:
-                return int(s.replace("ses-", ""))
-            except ValueError:
-                return 999999
-
-        for subj in sorted(subject_dict.keys(), key=sub_numeric_key):
-            print(f"--- Subject: {subj} ---")
-            print("Sessions:")
-            sorted_ses = sorted(subject_dict[subj].keys(), key=ses_numeric_key)
-            for ses in sorted_ses:
-                print(f"  • {subject_dict[subj][ses]['out_dir']}")
-            print("")
-
-        print("Please specify how to filter studies to download:")
-        print(" • If only session labels are entered (e.g., 'ses-01 ses-02'),")
-        print("   those sessions will be downloaded for every subject.")
-        print(" • If only subject labels are entered (e.g., 'sub-001 sub-002'),")
-        print("   a follow-up prompt for session selection will appear.")
-        print(" • If both subjects and sessions are entered (e.g. 'sub-001 ses-01'),")
-        print("   only those exact subject-session matches will be included.")
-        print(" • Or press Enter to download all available subjects and sessions.\n")
+        # Display/download order: one flat (subject, session, study) list, sorted once
+        # and reused by every branch below. The per-subject views are derived from it.
+        flat_plan = sorted(
+            ((subj, ses, st) for subj, ses_map in subject_dict.items() for ses, st in ses_map.items()),
+            key=lambda p: (sub_numeric_key(p[0]), p[0], ses_numeric_key(p[1])),
+        )
+        sorted_ses_by_sub = {}
+        for subj, ses, _ in flat_plan:
+            sorted_ses_by_sub.setdefault(subj, []).append(ses)
+        sorted_subjects = list(sorted_ses_by_sub)
+
+        # The listing and the instructions are written in one go before the prompt
+        buf = io.StringIO()
+        print("\nThe following subjects and sessions are available:\n", file=buf)
+
+        for subj in sorted_subjects:
+            print(f"--- Subject: {subj} ---", file=buf)
+            print("Sessions:", file=buf)
+            ses_map = subject_dict[subj]
+            for ses in sorted_ses_by_sub[subj]:
+                print(f"  • {ses_map[ses]['out_dir']}", file=buf)
+            print("", file=buf)
+
+        print("Please specify how to filter studies to download:", file=buf)
+        print(" • If only session labels are entered (e.g., 'ses-01 ses-02'),", file=buf)
+        print("   those sessions will be downloaded for every subject.", file=buf)
+        print(" • If only subject labels are entered (e.g., 'sub-001 sub-002'),", file=buf)
+        print("   a follow-up prompt for session selection will appear.", file=buf)
+        print(" • If both subjects and sessions are entered (e.g. 'sub-001 ses-01'),", file=buf)
+        print("   only those exact subject-session matches will be included.", file=buf)
+        print(" • Or press Enter to download all available subjects and sessions.\n", file=buf)
+        print(buf.getvalue(), end="", flush=True)
         user_line = input("> ").strip()
 
         do_cleanup = bool(config.get("cfmm2tar_attached_tar", False))
 
+        # Each branch below only builds the plan (the studies to download, in order);
+        # _run_plan then downloads them. Each subject's sessions are fetched by one
+        # container, and subjects run in parallel.
+        plan = None
+
         # (A) Pressed Enter => all subjects, all sessions
         if user_line == "":
-            print("\n============== RUNNING DICOMATIC DOCKER COMMANDS  ==============\n")
-            for subj in sorted(subject_dict.keys(), key=sub_numeric_key):
-                ses_keys = sorted(subject_dict[subj].keys(), key=ses_numeric_key)
-                for ses in ses_keys:
-                    st = subject_dict[subj][ses]
-                    run_dicom_download_command(
-                        st,
-                        credentials_file,
-                        do_cleanup=do_cleanup,
-                        check_existing_archives=True,
-                        create_dicom_metadata=create_dicom_metadata
-                    )
-            print("\nAll docker operations have been completed.\n")
-            maybe_save_new_server_settings(config, config_path, changed_server_settings, True)
-            return
+            plan = [st for _, _, st in flat_plan]
+        else:
+            tokens = user_line.split()
+
+            # Classify the tokens (a label is either a subject or a session). The set of
+            # all session labels is only built if some token is not a subject.
+            recognized_subs = []
+            other_tokens = []
+            for t in tokens:
+                if t in subject_dict:
+                    recognized_subs.append(t)
+                else:
+                    other_tokens.append(t)
+            recognized_ses = []
+            if other_tokens:
+                all_ses_keys = set().union(*subject_dict.values())
+                recognized_ses = [t for t in other_tokens if t in all_ses_keys]
+            # A label typed twice is only downloaded once; first-seen order is kept
+            recognized_subs = list(dict.fromkeys(recognized_subs))
+            recognized_ses = list(dict.fromkeys(recognized_ses))
+
+            # (B) Only sessions => apply to all subjects
+            if not recognized_subs and recognized_ses:
+                wanted_ses = set(recognized_ses)
+                plan = [st for _, ses, st in flat_plan if ses in wanted_ses]
+
+            # (C) Only subjects => prompt for each subject's sessions
+            elif recognized_subs and not recognized_ses:
+                # Collect session inputs for each recognized subject
+                session_map_input = prompt_sessions_per_subject(recognized_subs, sorted_ses_by_sub)
+
+                plan = []
+                for subj, user_sessions_line in session_map_input.items():
+                    ses_map = subject_dict[subj]
+                    if user_sessions_line == "":
+                        for ses in sorted_ses_by_sub[subj]:
+                            plan.append(ses_map[ses])
+                    else:
+                        chosen_ses = valid_sessions(subj, user_sessions_line.split(), ses_map)
+                        plan.extend(ses_map[ses] for ses in chosen_ses)
+
+            # (D) Both subjects and sessions
+            elif recognized_subs and recognized_ses:
+                plan = []
+                for subj in recognized_subs:
+                    ses_map = subject_dict.get(subj)
+                    if ses_map is None:
+                        print(f"{subj} not found in matched studies. Skipping.\n")
+                        continue
+                    chosen_ses = valid_sessions(subj, recognized_ses, ses_map)
+                    plan.extend(ses_map[ses] for ses in chosen_ses)
 
-        tokens = user_line.split()
-        recognized_subs = [t for t in tokens if t in subject_dict]
-
-        all_ses_keys = set()
-        for sbj in subject_dict:
-            all_ses_keys.update(subject_dict[sbj].keys())
-        recognized_ses = [t for t in tokens if t in all_ses_keys]
-
-        # (B) Only sessions => apply to all subjects
-        if not recognized_subs and recognized_ses:
-            print("\n============== RUNNING DICOMATIC DOCKER COMMANDS  ==============\n")
-            for subj in sorted(subject_dict.keys(), key=sub_numeric_key):
-                ses_keys = sorted(subject_dict[subj].keys(), key=ses_numeric_key)
-                for ses in ses_keys:
-                    if ses in recognized_ses:
-                        st = subject_dict[subj][ses]
-                        run_dicom_download_command(
-                            st,
-                            credentials_file,
-                            do_cleanup=do_cleanup,
-                            check_existing_archives=True,
-                            create_dicom_metadata=create_dicom_metadata
-                        )
-            print("\nAll docker operations have been completed.\n")
-            maybe_save_new_server_settings(config, config_path, changed_server_settings, True)
-            return
-
-        # (C) Only subjects => prompt for each subject's sessions
-        if recognized_subs and not recognized_ses:
-            # Collect session inputs for each recognized subject
-            session_map_input = {}
-            for subj in recognized_subs:
-                if subj not in subject_dict:
-                    print(f"{subj} not found in matched studies. Skipping.\n")
-                    continue
-                ses_keys = sorted(subject_dict[subj].keys(), key=ses_numeric_key)
+        if plan is None:
+            print("No recognized subjects or sessions found. Exiting.")
+            return query_was_successful
 
-                print(f"Enter sessions to download for {subj} (space-separated), or press Enter for all:")
-                user_sessions_line = input("> ").strip()
-                session_map_input[subj] = user_sessions_line
+        _run_plan(plan, partial(download_studies, batch_per_subject=True, do_cleanup=do_cleanup,
+                                check_existing_archives=True))
 
-            print("\n============== RUNNING DICOMATIC DOCKER COMMANDS  ==============\n")
-            for subj in recognized_subs:
-                if subj not in subject_dict:
-                    continue
-                user_sessions_line = session_map_input[subj]
-                ses_keys = sorted(subject_dict[subj].keys(), key=ses_numeric_key)
-                if user_sessions_line == "":
-                    for ses in ses_keys:
-                        st = subject_dict[subj][ses]
-                        run_dicom_download_command(
-                            st,
-                            credentials_file,
-                            do_cleanup=do_cleanup,
-                            check_existing_archives=True,
-                            create_dicom_metadata=create_dicom_metadata
-                        )
-                else:
-                    chosen_ses = user_sessions_line.split()
-                    for ses in chosen_ses:
-                        if ses not in subject_dict[subj]:
-                            print(f"  Session {ses} not found for {subj}. Skipping.\n")
-                            continue
-                        st = subject_dict[subj][ses]
-                        run_dicom_download_command(
-                            st,
-                            credentials_file,
-                            do_cleanup=do_cleanup,
-                            check_existing_archives=True,
-                            create_dicom_metadata=create_dicom_metadata
-                        )
-            print("\nAll docker operations have been completed.\n")
-            maybe_save_new_server_settings(config, config_path, changed_server_settings, True)
-            return
-
-        # (D) Both subjects and sessions
-        if recognized_subs and recognized_ses:
-            print("\n============== RUNNING DICOMATIC DOCKER COMMANDS  ==============\n")
-            for subj in recognized_subs:
-                if subj not in subject_dict:
-                    print(f"{subj} not found in matched studies. Skipping.\n")
-                    continue
-                for ses in recognized_ses:
-                    if ses not in subject_dict[subj]:
-                        print(f"  Session {ses} not found for {subj}. Skipping.\n")
-                        continue
-                    st = subject_dict[subj][ses]
-                    run_dicom_download_command(
-                        st,
-                        credentials_file,
-                        do_cleanup=do_cleanup,
-                        check_existing_archives=True,
-                        create_dicom_metadata=create_dicom_metadata
-                    )
-            print("\nAll docker operations have been completed.\n")
-            maybe_save_new_server_settings(config, config_path, changed_server_settings, True)
-            return
-
-        print("No recognized subjects or sessions found. Exiting.")
-        maybe_save_new_server_settings(config, config_path, changed_server_settings, True)
+    return query_was_successful
+
+
+def main():
+    """Main entry point for the DICOM Query & Download tool.
+
+    Provides a menu-driven interface for various query modes:
+      1) By StudyDescription
+      2) By PatientName
+      3) By local BIDS subjects in /sourcedata/dicom
+
+    Returns:
+        None
+    """
+    config_path = os.path.join(_SCRIPT_DIR, "config.yaml")
+
+    print("\n[==== DICOMATIC - DICOM Query & Download ====]")
+    print("        A DICOM Query & Download Tool")
+
+    with open(config_path, "r") as f:
+        config = yaml.load(f, Loader=_YAML_LOADER)
+
+    debug = False  # Set to True for verbose logs
+
+    # 1) Credentials
+    use_secrets_file, username, password, secrets_file_path = get_credentials(config, debug=debug)
+    config["dicom"]["username"] = username
+    config["dicom"]["password"] = password
+
+    # 2) Server info
+    dicom_config = config["dicom"]
+    changed_server_settings = prompt_for_server_info(dicom_config, debug=debug)
+
+    # 3) Create temp credentials file if needed
+    if use_secrets_file:
+        credentials_file = secrets_file_path
+    else:
+        credentials_file = create_temp_credentials_file(username, password)
+        if debug:
+            print(f"[DEBUG] Created temporary credentials file: {credentials_file}")
+
+    create_dicom_metadata = config.get("create_dicom_metadata", False)
+    download_parallelism = max(1, int(config.get("download_parallelism", 4)))
+
+    # The download settings shared by every mode, bound once
+    download_studies = partial(
+        run_dicom_downloads,
+        credentials_file=credentials_file,
+        max_workers=download_parallelism,
+        create_dicom_metadata=create_dicom_metadata
+    )
+
+    # Menu selection
+    while True:
+        print("\nWhich query+download mode do you want?")
+        print(" 1) By StudyDescription (list multiple studies)")
+        print(" 2) By PatientName (search for a specific participant)")
+        print(" 3) By local BIDS subjects in /sourcedata/dicom\n")
+        choice = input("Enter 1, 2, or 3.\n> ").strip()
+        if choice in ("1", "2", "3"):
+            break
+        print("Invalid choice. Please enter '1', '2', or '3'.")
+
+    query_was_successful = _run_query_mode(choice, config, download_studies, debug=debug)
+
+    # Only offered once the chosen mode has returned normally, never on an abort
+    maybe_save_new_server_settings(config, config_path, changed_server_settings,
+                                   query_was_successful)
 
 
 if __name__ == "__main__":